@@ -5,13 +5,20 @@ import time
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 
-from threading import Thread
+from threading import Thread, Event
+from collections import deque
 import pdb
 
 
 from queue import Queue
 from queue import Empty as EmptyException
 
+SETPOINT_PERIOD = 0.05 # 20 Hz while the setpoint is changing
+KEEPALIVE_PERIOD = 0.15 # the commander watchdog levels out after 500 ms of silence
+DEGRADED_PERIOD = 0.1 # changing setpoints on a bad link
+LINK_QUALITY_DEGRADED = 70 # percent, as reported by cflib
+LINK_QUALITY_RECOVERED = 85 # must climb back above this to leave degraded mode
+RATE_WINDOW = 2.0 # seconds of history used for setpointRate()
 
 
 class ActionRequest(object):
@@ -70,8 +77,14 @@ class ParameterRequest(ActionRequest):
 
 class CrazyflieManager:
 
-    def __init__(self, link_uri, callbackQueue = None):
-        """ Initialize and run the example with the specified link_uri """
+    def __init__(self, link_uri, callbackQueue = None, adaptiveRate = False):
+        """ Initialize and run the example with the specified link_uri
+
+        With adaptiveRate set, unchanged setpoints are only resent often
+        enough to keep the commander watchdog happy, and changed ones are
+        paced more slowly while the link quality is degraded. The keepalive
+        period does not depend on the link quality.
+        """
         # Create a Crazyflie object without specifying any cache dirs
         self._cf = Crazyflie()
         self.logger = logging.getLogger(__name__)
@@ -83,6 +96,7 @@ class CrazyflieManager:
         self._cf.disconnected.add_callback(self._disconnected)
         self._cf.connection_failed.add_callback(self._connection_failed)
         self._cf.connection_lost.add_callback(self._connection_lost)
+        self._cf.link_quality_updated.add_callback(self._link_quality_updated)
 
         self.logger.info('Connecting to %s' % link_uri)
 
@@ -104,9 +118,19 @@ class CrazyflieManager:
         self._callbackQueue = callbackQueue
         self._currentTask = None
 
+        self._adaptiveRate = adaptiveRate
+        self._wakeup = Event()
+        self.linkQuality = 100
+        self.linkDegraded = False
+        self._lastSetpoint = None
+        self._lastSendTime = 0
+        self._sendTimes = deque()
+        self.setpointsSent = 0
+
     # TODO: this should be a property
     def stop(self):
         self._willStop = True
+        self._wakeup.set()
 
     def isStopped(self):
         return self._willStop
@@ -116,11 +140,17 @@ class CrazyflieManager:
             raise RuntimeError('Should only put ActionRequests into the job queue')
 
         self._updateQueue.put(task)
+        self._wakeup.set()
         self.logger.debug("Added task {}".format(task))
 
     def isBusy(self):
         return (not self._updateQueue.empty()) and (self._currentTask is not None)
 
+    def setpointRate(self):
+        """ Setpoint packets per second sent over the last RATE_WINDOW seconds """
+        cutoff = time.time() - RATE_WINDOW
+        return len([t for t in list(self._sendTimes) if t >= cutoff])/RATE_WINDOW
+
     def _connected(self, link_uri):
         """ This callback is called form the Crazyflie API when a Crazyflie
         has been connected and the TOCs have been downloaded."""
@@ -152,11 +182,41 @@ class CrazyflieManager:
         elif self._currentTask is not None:
             # should we die?
             self.logger.error('Completed a task that was not next in queue!')
-            
-        
+        self._wakeup.set()
+
+    def _setpointPeriod(self):
+        if self.linkDegraded:
+            # back off to leave room for the retries
+            return DEGRADED_PERIOD
+        return SETPOINT_PERIOD
+
+    def _waitForSendSlot(self, setpoint):
+        """ Sleep until the setpoint is due. Returns False if new work arrived
+        while waiting to repeat an unchanged setpoint, in which case nothing
+        should be sent yet. """
+        if setpoint == self._lastSetpoint:
+            deadline = self._lastSendTime + KEEPALIVE_PERIOD
+            return not self._wakeup.wait(max(0, deadline - time.time()))
+        delay = self._lastSendTime + self._setpointPeriod() - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def _sendSetpoint(self, setpoint):
+        (roll, pitch, yaw, thrust) = setpoint
+        self._cf.commander.send_setpoint(roll, pitch, yaw, thrust)
+        now = time.time()
+        self._lastSetpoint = setpoint
+        self._lastSendTime = now
+        self.setpointsSent += 1
+        self._sendTimes.append(now)
+        while self._sendTimes[0] < now - RATE_WINDOW:
+            self._sendTimes.popleft()
+
 
     def _main_loop(self):
         while not self._willStop:
+            self._wakeup.clear()
             self.logger.debug("Current queue size is {}".format(self._updateQueue.qsize()))
             if self._currentTask is not None:
                 self.logger.debug('Current task is {}'.format(self._currentTask))
@@ -184,9 +244,13 @@ class CrazyflieManager:
                 except EmptyException:
                     self._currentTask = None   
             # rpyt
-            self._cf.commander.send_setpoint(self._nextRoll,self._nextPitch,self._nextYaw,self._nextThrottle)
+            setpoint = (self._nextRoll, self._nextPitch, self._nextYaw, self._nextThrottle)
+            if self._adaptiveRate and not self._waitForSendSlot(setpoint):
+                continue
+            self._sendSetpoint(setpoint)
             self._nextPitch = self._nextRoll = self._nextYaw = 0 # just little nudges for now
-            time.sleep(0.05) # should be enough to keep the commander online
+            if not self._adaptiveRate:
+                time.sleep(SETPOINT_PERIOD) # should be enough to keep the commander online
         # _willStop is true
         self._cf.close_link()
         
@@ -216,8 +280,20 @@ class CrazyflieManager:
         Crazyflie moves out of range)"""
         self.logger.error('Connection to %s lost: %s' % (link_uri, msg))
 
+    def _link_quality_updated(self, percentage):
+        """Callback with the link quality (0-100) estimated by cflib from
+        the radio retry count"""
+        self.linkQuality = percentage
+        if not self.linkDegraded and percentage < LINK_QUALITY_DEGRADED:
+            self.linkDegraded = True
+            self.logger.warning('Link quality down to {}%, slowing setpoint rate'.format(percentage))
+        elif self.linkDegraded and percentage > LINK_QUALITY_RECOVERED:
+            self.linkDegraded = False
+            self.logger.warning('Link quality back to {}%, restoring setpoint rate'.format(percentage))
+
     def _disconnected(self, link_uri):
         """Callback when the Crazyflie is disconnected (called in all cases)"""
         self.logger.warning('Disconnected from %s' % link_uri)
         self.is_connected = False
-        self._willStop = True
\ No newline at end of file
+        self._willStop = True
+        self._wakeup.set()
\ No newline at end of file
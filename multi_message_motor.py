@@ -40,7 +40,7 @@ def findCopterWithAddress(addr):
         logger.debug(i[0])
         if '125' in i[0]:
             chosen = i
-    pe = CrazyflieManager(chosen[0], callbackQ)
+    pe = CrazyflieManager(chosen[0], callbackQ, adaptiveRate=True)
     return pe
 
 def initChirpParams(cflie):
@@ -131,6 +131,18 @@ def anyConnected():
             break
     return flag
 
+RATE_REPORT_INTERVAL = 5.0
+lastRateReport = 0
+
+def reportSetpointRates():
+    global lastRateReport
+    if time.time() - lastRateReport < RATE_REPORT_INTERVAL:
+        return
+    lastRateReport = time.time()
+    for cf in chirpingCopters+nonChirpingCopters:
+        print('Copter {:x}: {:.1f} setpoints/s ({} total), link quality {}%'.format(
+            cf.address, cf.setpointRate(), cf.setpointsSent, cf.linkQuality))
+
 '''
 try:
     chirpDc = float(input('Chirping duty cycle: '))
@@ -156,6 +168,7 @@ for addr in copterAddresses:
         cf = findCopterWithAddress(addr)
         time.sleep(0.1)
     
+    cf.address = addr
     cf.msgNum = 0
     if (len(chirpingCopters) < nChirping):
         idx = len(chirpingCopters)
@@ -199,6 +212,7 @@ while busy:
             time.sleep(0.5)
         # nothing left to process, wait for crazyflies to disconnect
         busy = anyConnected()
+        reportSetpointRates()
         # check that all the chirping copters are done, and if so, turn off the non chirping copters
         nDone = 0
         for cf in chirpingCopters: